@@ -22,10 +22,19 @@
 from __future__ import absolute_import, division, with_statement
 import itertools
 import logging
+import random
+import threading
 import time
 import sys
+import Queue
 import umysql
 
+try:
+    from concurrent.futures import ThreadPoolExecutor
+except ImportError:
+    # AsyncConnection needs the `futures` backport, installed by setup.py
+    ThreadPoolExecutor = None
+
 __title__ = 'ezmysql'
 __version__ = "1.0"
 __author__ = 'Veelion Chong'
@@ -59,7 +68,8 @@ class Connection(object):
     def __init__(self, host, port, user, password,
                  database='',
                  charset='utf8',
-                 autocommit=1):
+                 autocommit=1,
+                 advisor=None):
 
 
         self.host = host
@@ -85,6 +95,12 @@ class Connection(object):
         self._db = None
         self._db_args = args
         self._last_use_time = time.time()
+        # optional QueryAdvisor sampling EXPLAIN of generated selects
+        self.advisor = advisor
+        # {(table_name, sql, args): (stored_at, count)} for count_by_wheres
+        self._count_cache = {}
+        # AsyncConnection shares one cache and lock across its pool
+        self._count_lock = threading.Lock()
         try:
             self.reconnect()
         except Exception:
@@ -244,7 +260,9 @@ class Connection(object):
         )
         args = updates.values()
         args.append(where_value)
-        return self.execute(sql, *args)
+        r = self.execute(sql, *args)
+        self._forget_counts(table_name)
+        return r
 
     select_process = {
         "__in_": lambda k, where_dict: '%s in (%s)' % ( k, where_dict[k]['__in_'] ),
@@ -257,22 +275,35 @@ class Connection(object):
         "__all_like_": lambda k, where_dict: "%s LIKE '%%%%%s%%%%'" % (k, where_dict[k]['__all_like_']),
     }
 
-    def select_table_by_wheres(self, table_name, select_fields, where_dict, limit_conf=None, select_type="list", group_by_fields=None, order_by_fields=None, lock=False):
-        '''根据条件查询记录  add by ghostbod'''
-
-
-        selects = ','.join(select_fields)
+    def _build_wheres(self, where_dict):
+        '''
+            where_dict 转为 (wheres, args, where_ops), where_dict 不会被修改
 
+            wheres are the SQL conditions, args the values for their '%s',
+            where_ops the (field, operator) pairs, operator being '=' or
+            a key of select_process.
+        '''
         wheres = []
+        args = []
+        where_ops = []
         for k in where_dict.keys():
             if type(where_dict[k])==dict:
                 protype = where_dict[k].keys()[0]
-                if protype in self.select_process.keys():
-                    s = self.select_process[protype](k, where_dict)
-                where_dict.pop(k)
+                if protype not in self.select_process:
+                    raise ValueError('unknown where operator %s for %s' % (protype, k))
+                wheres.append(self.select_process[protype](k, where_dict))
+                where_ops.append((k, protype))
             else:
-                s = '%s=%%s' % k
-            wheres.append(s)
+                wheres.append('%s=%%s' % k)
+                args.append(where_dict[k])
+                where_ops.append((k, '='))
+        return wheres, args, where_ops
+
+    def select_table_by_wheres(self, table_name, select_fields, where_dict, limit_conf=None, select_type="list", group_by_fields=None, order_by_fields=None, lock=False):
+        '''根据条件查询记录  add by ghostbod'''
+
+        selects = ','.join(select_fields)
+        wheres, args, where_ops = self._build_wheres(where_dict)
 
         if len(wheres) != 0:
             wheres = " AND ".join(wheres)
@@ -294,9 +325,16 @@ class Connection(object):
             # select_type = "list"
             sql += ' LIMIT %s, %s' % (limit_conf['start'], limit_conf['count'])
 
-        args = where_dict.values()
         lock_str = " FOR UPDATE " if lock == True else ""
-        
+
+        if self.advisor is not None:
+            self.advisor.observe(
+                self, sql+" LIMIT 1" if select_type=="get" else sql, args,
+                table_name, select_fields, where_ops,
+                group_by_fields, order_by_fields,
+                limit_conf is not None or select_type=="get"
+            )
+
         if select_type=="get":
             print sql+" LIMIT 1"+lock_str, args
             return self.get(sql+" LIMIT 1"+lock_str, *args)
@@ -306,6 +344,96 @@ class Connection(object):
 
 
 
+    # most counts count_by_wheres keeps cached
+    count_cache_size = 1024
+
+    def count_by_wheres(self, table_name, where_dict, approximate=False, ttl=10):
+        '''
+            根据条件统计记录数, where_dict 同 select_table_by_wheres
+
+            Without approximate, always runs COUNT(*) and caches the result
+            (ttl=0 disables the cache). With approximate=True a cached count
+            less than `ttl` seconds old is returned if there is one, else the
+            estimate from EXPLAIN rows, or from TABLE_ROWS when where_dict
+            is empty, falling back to COUNT(*) when there is no estimate.
+            Writes through the *_table helpers clear the table's cached
+            counts, writes through execute() do not.
+        '''
+        wheres, args, where_ops = self._build_wheres(where_dict)
+        if len(wheres)==0:
+            sql = 'SELECT COUNT(*) AS c FROM %s' % table_name
+        else:
+            sql = 'SELECT COUNT(*) AS c FROM %s WHERE %s' % (table_name, " AND ".join(wheres))
+
+        key = (table_name, sql, tuple(args))
+        if approximate:
+            with self._count_lock:
+                cached = self._count_cache.get(key)
+            if cached is not None and time.time() - cached[0] < ttl:
+                return cached[1]
+            estimate = None
+            if len(wheres)==0:
+                estimate = self._table_rows_estimate(table_name)
+            if estimate is None:
+                estimate = self._explain_rows_estimate(
+                    sql.replace('COUNT(*) AS c', '1', 1), args)
+            if estimate is not None:
+                return estimate
+
+        print sql, args
+        count = int(self.get(sql, *args)['c'])
+        if ttl > 0:
+            now = time.time()
+            with self._count_lock:
+                cache = self._count_cache
+                if len(cache) >= self.count_cache_size:
+                    for k, v in cache.items():
+                        if now - v[0] >= ttl:
+                            del cache[k]
+                if len(cache) >= self.count_cache_size:
+                    # nothing old enough, drop the oldest entries
+                    oldest = sorted(cache, key=lambda k: cache[k][0])
+                    for k in oldest[:len(cache) - self.count_cache_size + 1]:
+                        del cache[k]
+                cache[key] = (now, count)
+        return count
+
+    def _forget_counts(self, table_name):
+        '''Drops the cached counts of `table_name` after a write'''
+        with self._count_lock:
+            for k in self._count_cache.keys():
+                if k[0] == table_name:
+                    del self._count_cache[k]
+
+    def _table_rows_estimate(self, table_name):
+        '''TABLE_ROWS of `table_name` or `db.table_name`, None if unknown'''
+        pair = table_name.split('.')
+        if len(pair) == 2:
+            sql = ('SELECT TABLE_ROWS AS c FROM INFORMATION_SCHEMA.TABLES'
+                   ' WHERE TABLE_SCHEMA=%s AND TABLE_NAME=%s')
+            args = pair
+        else:
+            sql = ('SELECT TABLE_ROWS AS c FROM INFORMATION_SCHEMA.TABLES'
+                   ' WHERE TABLE_SCHEMA=DATABASE() AND TABLE_NAME=%s')
+            args = [table_name]
+        r = self.get(sql, *args)
+        # no row for views, quoted/aliased names; NULL for some engines
+        if r is None or r['c'] is None:
+            return None
+        return int(r['c'])
+
+    def _explain_rows_estimate(self, sql, args):
+        '''Row estimate from EXPLAIN of `sql`, None if unknown'''
+        rows = self.query('EXPLAIN ' + sql, *args)
+        if not rows or rows[0].get('rows') is None:
+            return None
+        # 'filtered' only exists in EXPLAIN output of MySQL >= 5.7
+        filtered = rows[0].get('filtered')
+        if filtered is None:
+            filtered = 100
+        return int(rows[0]['rows'] * float(filtered) / 100)
+
+
     def select_tables_by_wheres(self, table, join_tables, select_fields, where_dict, limit_conf=None, select_type="list", group_by_fields=None, order_by_fields=None, lock=False):
         '''
             根据条件查询记录  add by ghostbod
@@ -445,7 +573,9 @@ class Connection(object):
         args += where_dict.values()
 
         print sql, args
-        return self.execute(sql, *args)
+        r = self.execute(sql, *args)
+        self._forget_counts(table_name)
+        return r
 
 
 
@@ -471,7 +601,9 @@ class Connection(object):
         args += where_values
 
         print sql, args
-        return self.execute(sql, *args)
+        r = self.execute(sql, *args)
+        self._forget_counts(table_name)
+        return r
 
     def delete_table_by_wheres(self, table_name, where_dict):
         '''根据字典条件删除记录'''
@@ -487,7 +619,9 @@ class Connection(object):
         )
         args = where_dict.values()
         print sql, args
-        return self.execute(sql, *args)
+        r = self.execute(sql, *args)
+        self._forget_counts(table_name)
+        return r
 
 
     def delete_table_by_fields(self, table_name,
@@ -505,7 +639,9 @@ class Connection(object):
         )
         args = where_values
         print sql, args
-        return self.execute(sql, *args)
+        r = self.execute(sql, *args)
+        self._forget_counts(table_name)
+        return r
 
 
     def item_to_table(self, table_name, item):
@@ -516,6 +652,7 @@ class Connection(object):
         try:
             print sql, item.values()
             r = self.execute(sql, *(item.values()))
+            self._forget_counts(table_name)
             return r
         except Exception, e:
             print '--------DB Exception-------\n', e
@@ -551,6 +688,289 @@ class Row(dict):
 
 
 
+class AsyncConnection(object):
+    """Runs Connection calls on a bounded pool of connections.
+
+    Every method of Connection listed in `pooled_methods` is available
+    here with the same arguments, but returns a concurrent.futures.Future
+    instead of blocking. At most `pool_size` queries run at once, each on
+    its own umysql connection, so their I/O overlaps. Like the rest of this
+    module it is Python 2 only; to run cooperatively, monkey patch with
+    gevent and the worker threads become greenlets. Typical usage::
+
+        db = ezmysql.AsyncConnection("localhost", 3306, user, password,
+                                     "mydatabase", pool_size=8)
+        futures = [db.get("SELECT * FROM articles WHERE id=%s", i)
+                   for i in ids]
+        articles = [f.result() for f in futures]
+
+    START TRANSACTION/COMMIT must run on one connection, use transaction()
+    rather than separate start_transaction()/commit() calls.
+
+    A transaction()/submit() callable already holds a pooled connection,
+    so it must use the `conn` it is given and never wait on another call
+    to the same AsyncConnection: with every worker doing so, the pool
+    deadlocks.
+    """
+
+    pooled_methods = (
+        'execute', 'query', 'get',
+        'is_in_table', 'is_in_table_by_wheres',
+        'update_table', 'update_table_by_wheres', 'update_table_by_fields',
+        'select_table_by_wheres', 'select_tables_by_wheres', 'count_by_wheres',
+        'delete_table_by_wheres', 'delete_table_by_fields',
+        'item_to_table', 'items_to_table',
+    )
+
+    def __init__(self, host, port, user, password,
+                 database='',
+                 charset='utf8',
+                 autocommit=1,
+                 advisor=None,
+                 pool_size=4):
+        if ThreadPoolExecutor is None:
+            raise ImportError("AsyncConnection needs concurrent.futures, "
+                              "install the 'futures' package")
+        self._pool = Queue.Queue()
+        # one count_by_wheres cache for the whole pool, whichever
+        # connection runs a count or a write
+        count_cache = {}
+        count_lock = threading.Lock()
+        for i in range(pool_size):
+            conn = Connection(host, port, user, password, database,
+                              charset, autocommit, advisor)
+            conn._count_cache = count_cache
+            conn._count_lock = count_lock
+            self._pool.put(conn)
+        self._executor = ThreadPoolExecutor(max_workers=pool_size)
+
+    def close(self):
+        """Waits for pending calls and closes all pooled connections."""
+        self._executor.shutdown(wait=True)
+        while not self._pool.empty():
+            self._pool.get().close()
+
+    def _run(self, fn, *args, **kwargs):
+        conn = self._pool.get()
+        try:
+            return fn(conn, *args, **kwargs)
+        finally:
+            self._pool.put(conn)
+
+    def submit(self, fn, *args, **kwargs):
+        """Runs fn(conn, *args, **kwargs) on a pooled Connection."""
+        return self._executor.submit(self._run, fn, *args, **kwargs)
+
+    def transaction(self, fn, *args, **kwargs):
+        """Runs fn(conn, *args, **kwargs) inside a transaction on one
+        pooled Connection, committing if it returns and rolling back
+        if it raises.
+        """
+        return self.submit(self._transaction, fn, *args, **kwargs)
+
+    @staticmethod
+    def _transaction(conn, fn, *args, **kwargs):
+        conn.start_transaction()
+        try:
+            r = fn(conn, *args, **kwargs)
+        except Exception:
+            conn.rollback()
+            raise
+        conn.commit()
+        return r
+
+
+def _pooled(name):
+    def method(self, *args, **kwargs):
+        return self.submit(getattr(Connection, name), *args, **kwargs)
+    method.__name__ = name
+    method.__doc__ = 'Connection.%s() on a pooled connection, returns a Future.' % name
+    return method
+
+for _name in AsyncConnection.pooled_methods:
+    setattr(AsyncConnection, _name, _pooled(_name))
+del _name
+
+
+class QueryAdvisor(object):
+    """Samples EXPLAIN plans of the SQL generated by select_table_by_wheres.
+
+    Plans are cached per query template, built from the query structure
+    with every value as '?', so `id in (1,2)` and `id in (7)` share one
+    entry.
+    The first call of a template is always explained, later calls with
+    probability `sample_rate`, up to `max_samples` times. Typical usage::
+
+        advisor = ezmysql.QueryAdvisor(sample_rate=0.05)
+        db = ezmysql.Connection(host, port, user, password, 'mydb',
+                                advisor=advisor)
+        ...
+        print advisor.report()
+    """
+
+    range_ops = ('__lt_', '__lte_', '__gt_', '__gte_', '__like_')
+    unusable_ops = {
+        '__ne_': '!= on %s cannot use an index',
+        '__all_like_': 'leading-wildcard LIKE on %s cannot use an index',
+    }
+
+    template_ops = {
+        '=': '%s=?',
+        '__in_': '%s IN (?)',
+        '__ne_': '%s!=?',
+        '__lt_': '%s<?',
+        '__lte_': '%s<=?',
+        '__gt_': '%s>?',
+        '__gte_': '%s>=?',
+        '__like_': "%s LIKE '?%%'",
+        '__all_like_': "%s LIKE '%%?%%'",
+    }
+
+    def __init__(self, sample_rate=0.01, max_samples=3):
+        self.sample_rate = sample_rate
+        self.max_samples = max_samples
+        self._templates = {}
+        self._lock = threading.Lock()
+
+    def template(self, table_name, select_fields, where_ops,
+                 group_by_fields=None, order_by_fields=None, limit=False):
+        """Returns the query template for the given query structure.
+
+        The values never reach the template, so unescaped operator
+        values pasted into the SQL can't split one query shape into
+        several entries.
+        """
+        t = 'SELECT %s FROM %s' % (','.join(select_fields), table_name)
+        if where_ops:
+            t += ' WHERE ' + ' AND '.join(
+                self.template_ops.get(op, '%s ? ?') % field
+                for field, op in sorted(where_ops))
+        if group_by_fields:
+            t += ' GROUP BY %s' % ','.join(group_by_fields)
+        if order_by_fields:
+            t += ' ORDER BY %s' % ','.join(order_by_fields)
+        if limit:
+            t += ' LIMIT ?'
+        return t
+
+    def observe(self, conn, sql, args, table_name, select_fields, where_ops,
+                group_by_fields=None, order_by_fields=None, limit=False):
+        """Records one execution of `sql`, running EXPLAIN if sampled.
+
+        where_ops is a list of (field, operator) where operator is '='
+        or one of the keys of Connection.select_process.
+        """
+        template = self.template(table_name, select_fields, where_ops,
+                                 group_by_fields, order_by_fields, limit)
+        with self._lock:
+            entry = self._templates.get(template)
+            if entry is None:
+                entry = self._templates[template] = {
+                    'template': template,
+                    'table': table_name,
+                    'where_ops': list(where_ops),
+                    'group_by': list(group_by_fields or []),
+                    'order_by': list(order_by_fields or []),
+                    'calls': 0,
+                    'samples': 0,
+                    'plan': None,
+                }
+            entry['calls'] += 1
+            if entry['samples'] >= self.max_samples:
+                return
+            if entry['samples'] and random.random() >= self.sample_rate:
+                return
+            entry['samples'] += 1
+        try:
+            plan = conn.query('EXPLAIN ' + sql, *args)
+        except Exception:
+            logging.warning('EXPLAIN failed for: %s', sql, exc_info=True)
+            return
+        entry['plan'] = plan
+
+    def flags(self, entry):
+        """Returns the problems found in the cached plan of `entry`."""
+        flags = []
+        for row in entry['plan'] or []:
+            table = row.get('table')
+            if row.get('type') == 'ALL':
+                flags.append('full scan on %s' % table)
+            elif row.get('type') == 'index':
+                flags.append('full index scan on %s' % table)
+            extra = row.get('Extra') or ''
+            if 'Using filesort' in extra:
+                flags.append('filesort on %s' % table)
+            if 'Using temporary' in extra:
+                flags.append('temporary table on %s' % table)
+        return flags
+
+    def suggest_index(self, entry):
+        """Returns (columns, notes) for a composite index serving `entry`.
+
+        Equality columns come first, then IN columns, then either the
+        first range column or, when the where is all equalities, the
+        GROUP BY/ORDER BY columns.
+        """
+        eqs, ins, ranges, notes = [], [], [], []
+        for field, op in entry['where_ops']:
+            if op == '=':
+                eqs.append(field)
+            elif op == '__in_':
+                ins.append(field)
+            elif op in self.range_ops:
+                ranges.append(field)
+            elif op in self.unusable_ops:
+                notes.append(self.unusable_ops[op] % field)
+        columns = eqs + ins
+        if ranges:
+            columns.append(ranges[0])
+        elif not ins:
+            for f in entry['group_by'] or entry['order_by']:
+                f = f.split()[0]
+                if f not in columns:
+                    columns.append(f)
+        return columns, notes
+
+    def report(self):
+        """Returns a text report of flagged templates and index suggestions."""
+        with self._lock:
+            entries = sorted(self._templates.values(),
+                             key=lambda e: e['calls'], reverse=True)
+        lines = []
+        indexes = {}
+        for entry in entries:
+            if entry['plan'] is None:
+                continue
+            flags = self.flags(entry)
+            if not flags:
+                continue
+            columns, notes = self.suggest_index(entry)
+            lines.append('[%s] calls=%s samples=%s' % (
+                ', '.join(flags), entry['calls'], entry['samples']))
+            lines.append('    %s' % entry['template'])
+            for note in notes:
+                lines.append('    note: %s' % note)
+            if columns:
+                key = (entry['table'], tuple(columns))
+                indexes.setdefault(key, []).append(entry['template'])
+        if indexes:
+            lines.append('')
+            lines.append('Suggested indexes:')
+            for (table, columns), templates in sorted(indexes.items()):
+                lines.append('    ALTER TABLE %s ADD INDEX (%s) -- %s template(s)' % (
+                    table, ','.join(columns), len(templates)))
+                for t in templates:
+                    lines.append('        %s' % t)
+        if not lines:
+            return 'No flagged query templates (%s seen).' % len(entries)
+        return '\n'.join(lines)
+
+    def reset(self):
+        """Drops all cached templates and plans."""
+        with self._lock:
+            self._templates.clear()
+
+
 if __name__ == "__main__":
     cnn = umysql.Connection()
     cnn.connect ("127.0.0.1", 3306, "root", "123456", "tracking_db")
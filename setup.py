@@ -1,6 +1,9 @@
 #!/usr/bin/env python
 
-from distutils.core import setup
+try:
+    from setuptools import setup
+except ImportError:
+    from distutils.core import setup
 from ezmysql import __version__, __author__, __license__
 
 
@@ -12,6 +15,8 @@ setup(
     author_email='veelion@ebuinfo.com',
     url='https://github.com/veelion/ezmysql.git',
     py_modules=['ezmysql'],
+    # concurrent.futures for AsyncConnection
+    install_requires=['futures; python_version < "3"'],
     license=__license__
 )
 
@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+#
+# Copyright 2013 Ebuinfo
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""QueryAdvisor tests, run against umysql_stub without a MySQL server."""
+
+import sys
+import umysql_stub
+sys.modules['umysql'] = umysql_stub
+import ezmysql
+
+
+def explain_handler(plan):
+    def handler(sql, args):
+        if sql.startswith('EXPLAIN'):
+            return ('table', 'type', 'key', 'Extra'), plan
+        return ('id',), [(1,)]
+    return handler
+
+
+def explains():
+    return [q for q in umysql_stub.queries if q[0].startswith('EXPLAIN')]
+
+
+def connect(advisor):
+    return ezmysql.Connection('localhost', 3306, 'user', 'password', 'testdb',
+                              advisor=advisor)
+
+
+def test_template():
+    umysql_stub.reset(explain_handler([]))
+    advisor = ezmysql.QueryAdvisor(sample_rate=0)
+    db = connect(advisor)
+    for ids, start in (('1,2,3', 0), ('7', 20)):
+        db.select_table_by_wheres(
+            'orders', ['*'], {'user_id': 5, 'status': {'__in_': ids}},
+            limit_conf={'start': start, 'count': 10})
+    db.select_table_by_wheres('users', ['id'], {'name': {'__like_': "o'neil"}})
+    assert sorted(advisor._templates) == [
+        "SELECT * FROM orders WHERE status IN (?) AND user_id=? LIMIT ?",
+        "SELECT id FROM users WHERE name LIKE '?%'",
+    ], sorted(advisor._templates)
+    assert advisor._templates[
+        "SELECT * FROM orders WHERE status IN (?) AND user_id=? LIMIT ?"
+    ]['calls'] == 2
+
+
+def test_sampling():
+    umysql_stub.reset(explain_handler([]))
+    advisor = ezmysql.QueryAdvisor(sample_rate=0, max_samples=3)
+    db = connect(advisor)
+    for i in range(5):
+        db.select_table_by_wheres('orders', ['*'], {'id': i})
+    # the first call is always explained, sample_rate=0 skips the rest
+    assert len(explains()) == 1
+
+    umysql_stub.reset(explain_handler([]))
+    advisor = ezmysql.QueryAdvisor(sample_rate=1, max_samples=3)
+    db = connect(advisor)
+    for i in range(5):
+        db.select_table_by_wheres('orders', ['*'], {'id': i})
+    assert len(explains()) == 3
+    entry = advisor._templates.values()[0]
+    assert entry['calls'] == 5 and entry['samples'] == 3
+
+
+def test_flags():
+    advisor = ezmysql.QueryAdvisor()
+    plan = [
+        ezmysql.Row(table='a', type='ALL', Extra='Using where'),
+        ezmysql.Row(table='b', type='index', Extra='Using filesort'),
+        ezmysql.Row(table='c', type='ref', Extra='Using temporary; Using filesort'),
+        ezmysql.Row(table='d', type='const', Extra=None),
+    ]
+    assert advisor.flags({'plan': plan}) == [
+        'full scan on a',
+        'full index scan on b',
+        'filesort on b',
+        'filesort on c',
+        'temporary table on c',
+    ]
+    assert advisor.flags({'plan': None}) == []
+
+
+def test_suggest_index():
+    advisor = ezmysql.QueryAdvisor()
+
+    def suggest(where_ops, group_by=(), order_by=()):
+        return advisor.suggest_index({
+            'where_ops': where_ops,
+            'group_by': list(group_by),
+            'order_by': list(order_by),
+        })
+
+    # equalities, then IN, then the first range column
+    assert suggest([('created', '__gt_'), ('status', '__in_'),
+                    ('user_id', '='), ('price', '__lt_')],
+                   order_by=['id']) == (['user_id', 'status', 'created'], [])
+    # no range: equalities then GROUP BY, falling back to ORDER BY
+    assert suggest([('user_id', '=')], group_by=['day'],
+                   order_by=['created DESC']) == (['user_id', 'day'], [])
+    assert suggest([('user_id', '=')],
+                   order_by=['created DESC']) == (['user_id', 'created'], [])
+    # IN without range: the ORDER BY would still filesort
+    assert suggest([('status', '__in_')], order_by=['created']) == (['status'], [])
+    assert suggest([('title', '__all_like_')]) == (
+        [], ['leading-wildcard LIKE on title cannot use an index'])
+
+
+def test_report():
+    umysql_stub.reset(explain_handler(
+        [('orders', 'ALL', None, 'Using where; Using filesort')]))
+    advisor = ezmysql.QueryAdvisor()
+    db = connect(advisor)
+    db.select_table_by_wheres('orders', ['*'], {'user_id': 5},
+                              order_by_fields=['created DESC'])
+    report = advisor.report()
+    assert '[full scan on orders, filesort on orders]' in report, report
+    assert 'ALTER TABLE orders ADD INDEX (user_id,created)' in report, report
+
+
+if __name__ == '__main__':
+    test_template()
+    test_sampling()
+    test_flags()
+    test_suggest_index()
+    test_report()
+    print 'testing succeed!'
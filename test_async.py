@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+#
+# Copyright 2013 Ebuinfo
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""AsyncConnection tests, run against umysql_stub without a MySQL server."""
+
+import sys
+import umysql_stub
+sys.modules['umysql'] = umysql_stub
+import ezmysql
+import time
+
+POOL_SIZE = 4
+
+
+def handler(sql, args):
+    if 'COUNT(*)' in sql:
+        return ('c',), [(42,)]
+    if sql.startswith('EXPLAIN'):
+        return ('table', 'rows', 'filtered'), [('t', 1000, 100.0)]
+    return ('id',), [(args[0] if args else 0,)]
+
+
+def connect(delay=0):
+    umysql_stub.reset(handler, delay)
+    return ezmysql.AsyncConnection('localhost', 3306, 'user', 'password',
+                                   'testdb', pool_size=POOL_SIZE)
+
+
+def test_overlap_and_bound():
+    db = connect(delay=0.2)
+    start = time.time()
+    futures = [db.get('SELECT %s', i) for i in range(2 * POOL_SIZE)]
+    assert [f.result()['id'] for f in futures] == range(2 * POOL_SIZE)
+    elapsed = time.time() - start
+    # run one by one this would take 2 * POOL_SIZE * 0.2 seconds
+    assert elapsed < POOL_SIZE * 0.2, elapsed
+    assert umysql_stub.max_active == POOL_SIZE, umysql_stub.max_active
+    db.close()
+
+
+def test_transaction():
+    db = connect()
+    r = db.transaction(lambda conn, x: conn.get('SELECT %s', x), 7).result()
+    assert r['id'] == 7
+    assert [q[0] for q in umysql_stub.queries] == [
+        'START TRANSACTION', 'SELECT %s', 'COMMIT']
+
+    umysql_stub.reset(handler)
+
+    def fail(conn):
+        conn.execute('UPDATE t SET a=1')
+        raise RuntimeError('boom')
+    future = db.transaction(fail)
+    assert isinstance(future.exception(), RuntimeError)
+    assert [q[0] for q in umysql_stub.queries] == [
+        'START TRANSACTION', 'UPDATE t SET a=1', 'ROLLBACK']
+    db.close()
+
+
+def test_close_drains_pool():
+    db = connect(delay=0.1)
+    futures = [db.get('SELECT %s', i) for i in range(POOL_SIZE)]
+    db.close()
+    assert all(f.done() for f in futures)
+    assert db._pool.empty()
+    assert len(umysql_stub.closed) == POOL_SIZE
+
+
+def test_shared_count_cache():
+    db = connect()
+    assert db.count_by_wheres('t', {'a': 1}).result() == 42
+    futures = [db.count_by_wheres('t', {'a': 1}, approximate=True)
+               for i in range(2 * POOL_SIZE)]
+    assert [f.result() for f in futures] == [42] * (2 * POOL_SIZE)
+    # every pooled connection saw the cached count, none ran EXPLAIN
+    assert not [q for q in umysql_stub.queries if q[0].startswith('EXPLAIN')]
+    db.close()
+
+
+if __name__ == '__main__':
+    test_overlap_and_bound()
+    test_transaction()
+    test_close_drains_pool()
+    test_shared_count_cache()
+    print 'testing succeed!'
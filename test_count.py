@@ -0,0 +1,144 @@
+#!/usr/bin/env python
+#
+# Copyright 2013 Ebuinfo
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""count_by_wheres tests, run against umysql_stub without a MySQL server."""
+
+import sys
+import umysql_stub
+sys.modules['umysql'] = umysql_stub
+import ezmysql
+
+
+class FakeServer(object):
+    """Answers COUNT(*), EXPLAIN and INFORMATION_SCHEMA queries."""
+    def __init__(self, count=42, table_rows=1000, explain_rows=200, filtered=50.0):
+        self.count = count
+        self.table_rows = table_rows
+        self.explain_rows = explain_rows
+        self.filtered = filtered
+
+    def __call__(self, sql, args):
+        if sql.startswith('EXPLAIN'):
+            return ('table', 'rows', 'filtered'), [('t', self.explain_rows, self.filtered)]
+        if 'INFORMATION_SCHEMA' in sql:
+            if self.table_rows is False:
+                return ('c',), []
+            return ('c',), [(self.table_rows,)]
+        if 'COUNT(*)' in sql:
+            return ('c',), [(self.count,)]
+        return (), ()
+
+
+def connect(server):
+    umysql_stub.reset(server)
+    return ezmysql.Connection('localhost', 3306, 'user', 'password', 'testdb')
+
+
+def counts():
+    return [q for q in umysql_stub.queries if q[0].startswith('SELECT COUNT')]
+
+
+def test_build_wheres():
+    db = connect(FakeServer())
+    where = {'user_id': 5, 'status': {'__in_': '1,2'}}
+    wheres, args, where_ops = db._build_wheres(where)
+    assert sorted(wheres) == ['status in (1,2)', 'user_id=%s']
+    assert args == [5]
+    assert sorted(where_ops) == [('status', '__in_'), ('user_id', '=')]
+    # the caller's dict is left alone, so it can be reused for the count
+    assert where == {'user_id': 5, 'status': {'__in_': '1,2'}}
+    try:
+        db._build_wheres({'a': {'__bogus_': 1}})
+    except ValueError:
+        pass
+    else:
+        assert False, 'unknown operator accepted'
+
+
+def test_exact_is_never_stale():
+    server = FakeServer(count=42)
+    db = connect(server)
+    assert db.count_by_wheres('t', {'a': 1}) == 42
+    server.count = 43
+    assert db.count_by_wheres('t', {'a': 1}) == 43
+    assert len(counts()) == 2
+
+
+def test_approximate_uses_cached_exact():
+    server = FakeServer(count=42)
+    db = connect(server)
+    assert db.count_by_wheres('t', {'a': 1}) == 42
+    server.count = 43
+    assert db.count_by_wheres('t', {'a': 1}, approximate=True) == 42
+    assert len(counts()) == 1
+
+    # a write through the helpers clears the table's cached counts
+    db.item_to_table('t', {'a': 1})
+    assert db.count_by_wheres('t', {'a': 1}, approximate=True) == 100
+
+
+def test_ttl_is_read_per_call():
+    server = FakeServer(count=42, explain_rows=200, filtered=50.0)
+    db = connect(server)
+    assert db.count_by_wheres('t', {'a': 1}, ttl=60) == 42
+    # age the entry instead of sleeping
+    for k, v in db._count_cache.items():
+        db._count_cache[k] = (v[0] - 2, v[1])
+    assert db.count_by_wheres('t', {'a': 1}, approximate=True, ttl=60) == 42
+    assert db.count_by_wheres('t', {'a': 1}, approximate=True, ttl=1) == 100
+    assert db.count_by_wheres('t', {'a': 1}, approximate=True, ttl=0) == 100
+
+
+def test_cache_size_limit():
+    db = connect(FakeServer(count=42))
+    db.count_cache_size = 10
+    for i in range(30):
+        db.count_by_wheres('t', {'a': i}, ttl=60)
+        assert len(db._count_cache) <= 10
+    # the count just stored survives the trimming
+    assert ('t', 'SELECT COUNT(*) AS c FROM t WHERE a=%s', (29,)) in db._count_cache
+
+
+def test_approximate_estimates():
+    db = connect(FakeServer(table_rows=1000, explain_rows=200, filtered=50.0))
+    assert db.count_by_wheres('t', {}, approximate=True) == 1000
+    assert db.count_by_wheres('t', {'a': 1}, approximate=True) == 100
+    db = connect(FakeServer(explain_rows=200, filtered=0.0))
+    assert db.count_by_wheres('t', {'a': 1}, approximate=True) == 0
+    db = connect(FakeServer(explain_rows=200, filtered=None))
+    assert db.count_by_wheres('t', {'a': 1}, approximate=True) == 200
+
+
+def test_approximate_fallbacks():
+    # TABLE_ROWS NULL or missing: EXPLAIN estimate instead of a made-up 0
+    db = connect(FakeServer(table_rows=None, explain_rows=300, filtered=100.0))
+    assert db.count_by_wheres('t', {}, approximate=True) == 300
+    db = connect(FakeServer(table_rows=False, explain_rows=300, filtered=100.0))
+    assert db.count_by_wheres('t', {}, approximate=True) == 300
+    # no estimate at all: exact COUNT(*)
+    db = connect(FakeServer(count=7, table_rows=None, explain_rows=None))
+    assert db.count_by_wheres('t', {}, approximate=True) == 7
+
+
+if __name__ == '__main__':
+    test_build_wheres()
+    test_exact_is_never_stale()
+    test_approximate_uses_cached_exact()
+    test_ttl_is_read_per_call()
+    test_cache_size_limit()
+    test_approximate_estimates()
+    test_approximate_fallbacks()
+    print 'testing succeed!'
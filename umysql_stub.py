@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+#
+# Copyright 2013 Ebuinfo
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""In-process stand-in for umysql, so ezmysql can be tested without a
+MySQL server. Install it before importing ezmysql::
+
+    import sys
+    import umysql_stub
+    sys.modules['umysql'] = umysql_stub
+    import ezmysql
+
+Every query is passed to `handler(sql, args)`, which returns
+(field_names, rows), after sleeping `delay` seconds.
+"""
+
+import threading
+import time
+
+
+def default_handler(sql, args):
+    return (), ()
+
+handler = default_handler
+delay = 0
+queries = []
+closed = []
+active = 0
+max_active = 0
+_lock = threading.Lock()
+
+
+def reset(new_handler=default_handler, new_delay=0):
+    global handler, delay, active, max_active
+    handler = new_handler
+    delay = new_delay
+    active = max_active = 0
+    del queries[:]
+    del closed[:]
+
+
+class Result(object):
+    def __init__(self, fields, rows):
+        self.fields = [(f,) for f in fields]
+        self.rows = list(rows)
+
+
+class Connection(object):
+    def connect(self, host, port, user, password, db, autocommit, charset):
+        pass
+
+    def close(self):
+        closed.append(self)
+
+    def query(self, sql, args):
+        global active, max_active
+        with _lock:
+            queries.append((sql, tuple(args)))
+            active += 1
+            max_active = max(max_active, active)
+        try:
+            if delay:
+                time.sleep(delay)
+            fields, rows = handler(sql, args)
+        finally:
+            with _lock:
+                active -= 1
+        return Result(fields, rows)